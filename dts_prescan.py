@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 SiFive Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+"""Parse only the part of a Devicetree which the memory map depends on
+
+Parsing the whole Devicetree with pydevicetree builds every peripheral,
+interrupt map and include, while the linker script only needs /chosen,
+/cpus, the memory-like nodes and the cache and WorldGuard controllers.
+The pre-scan splits the source into nodes and properties without parsing
+the property values, selects those nodes along with their ancestors and
+every node they reference, and only hands that subset to pydevicetree.
+
+Whenever the pre-scan finds something it doesn't handle, such as a
+reference it can't resolve or a /delete-node/ directive, the whole
+Devicetree is parsed instead.
+"""
+
+import collections
+import logging
+import os
+import re
+
+import pydevicetree
+
+LOGGER = logging.getLogger("ldscript_generator.dts_prescan")
+
+TOKEN_RE = re.compile(r'''
+      (?P<comment>//[^\n]*|/\*.*?\*/)
+    | (?P<string>"(?:\\.|[^"\\])*")
+    | (?P<pathref>&\{[^}]*\})
+    | (?P<punct>[{};])
+    | (?P<text>[^"{};&/]+|[&/])
+''', re.VERBOSE | re.DOTALL)
+
+STRING_RE = re.compile(r'"(?:\\.|[^"\\])*"')
+LABEL_REF_RE = re.compile(r'&([A-Za-z_][A-Za-z0-9_]*)')
+PATH_REF_RE = re.compile(r'&\{([^}]*)\}')
+LABEL_RE = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*):\s*')
+
+# Nodes which get_ram_memories() describes, by the name of the node
+RAM_NODE_RE = re.compile("itim|dtim|cache-controller|sys-sram|ils|dls")
+# Nodes which the memory map looks up by compatible string
+COMPATIBLE_RE = re.compile(r"sifive,(ccache[01]|worldguard1)")
+# Subtrees which are kept whole
+KEPT_PATHS = ["/chosen", "/cpus", "/aliases"]
+# Properties of ancestors of kept nodes which describe the address space
+STRUCTURAL_PROPERTIES = ["#address-cells", "#size-cells", "ranges"]
+
+
+class PrescanError(Exception):
+    """The pre-scan can't build the subset of the Devicetree"""
+
+
+class RawNode:
+    """A node of the Devicetree with the source of its properties. Before
+       the Devicetree is merged, each RawNode is one instance of a node in
+       the source, and a top-level node which refers to another node by
+       label or path has that reference."""
+    # pylint: disable=too-few-public-methods
+    def __init__(self, name, parent=None, reference=None):
+        self.name = name
+        self.parent = parent
+        self.reference = reference
+        self.labels = []
+        self.properties = []
+        self.children = []
+
+    def get_child(self, name):
+        """Get the child node with the name, with or without unit address"""
+        for child in self.children:
+            if child.name == name:
+                return child
+        for child in self.children:
+            if child.name.split("@")[0] == name:
+                return child
+        return None
+
+    def get_path(self, address=True):
+        """Get the path of the node, with or without unit addresses"""
+        if self.parent is None:
+            return "" if self.name == "/" else "/" + self.name
+        name = self.name if address else self.name.split("@")[0]
+        return "%s/%s" % (self.parent.get_path(address), name)
+
+    def walk(self):
+        """Iterate over the node and all the nodes below it"""
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+
+class Include:
+    """An /include/ directive"""
+    # pylint: disable=too-few-public-methods
+    def __init__(self, path):
+        self.path = path
+
+
+class Scanner:
+    """Split Devicetree source into a tree of RawNodes, merged in the same
+       order as pydevicetree merges the parsed Devicetree, so that the first
+       definition of each property is the one pydevicetree finds"""
+    def __init__(self):
+        self.root = RawNode("/")
+        self.labels = {}
+        self.elements = []
+        self.stack = []
+
+    def scan(self, path):
+        """Scan the Devicetree source file and the files it /include/s"""
+        roots = resolve_references(self.get_elements(path))
+        if not roots:
+            raise PrescanError("%s has no root node" % path)
+        self.root = merge_nodes(roots)
+        self.labels = {}
+        for node in self.root.walk():
+            for label in node.labels:
+                self.labels.setdefault(label, node)
+
+    def get_elements(self, path):
+        """Get the top-level elements of the Devicetree in the order
+           pydevicetree parses them: the contents of an /include/d file are
+           appended after every element found so far, and its path is
+           relative to the directory of the top-level file."""
+        pwd = os.path.dirname(path)
+        elements = self.scan_file(path)
+        i = 0
+        while i < len(elements):
+            if isinstance(elements[i], Include):
+                # pydevicetree fails to follow an /include/ after a node
+                if any(isinstance(element, RawNode) for element in elements[:i]):
+                    raise PrescanError("pydevicetree can't follow /include/ \"%s\" after a node"
+                                       % elements[i].path)
+                elements += self.scan_file(os.path.join(pwd, elements[i].path))
+                del elements[i]
+                # pydevicetree skips the element which takes the place of the
+                # /include/, so it never follows an /include/ found there
+                if i < len(elements) and isinstance(elements[i], Include):
+                    raise PrescanError("pydevicetree skips /include/ \"%s\""
+                                       % elements[i].path)
+            else:
+                i += 1
+        return elements
+
+    def scan_file(self, path):
+        """Split a Devicetree source file into its top-level elements: root
+           nodes, references to nodes and directives"""
+        with open(path) as source:
+            contents = source.read()
+
+        self.elements = []
+        self.stack = []
+        statement = ""
+        for match in TOKEN_RE.finditer(contents):
+            kind = match.lastgroup
+            token = match.group()
+            if kind == "comment":
+                statement += " "
+            elif kind == "string" and not self.stack and statement.strip() == "/include/":
+                self.elements.append(Include(token[1:-1]))
+                statement = ""
+            elif kind == "punct":
+                self.end_statement(statement.strip(), token)
+                statement = ""
+            else:
+                statement += token
+
+        if statement.strip() or self.stack:
+            raise PrescanError("%s ends in the middle of a statement" % path)
+        return self.elements
+
+    def end_statement(self, statement, token):
+        """Handle a statement ending with {, } or ;"""
+        if token == "{":
+            self.stack.append(self.open_node(statement))
+        elif token == "}":
+            if statement or not self.stack:
+                raise PrescanError("unexpected } after '%s'" % statement)
+            self.stack.pop()
+        elif self.stack:
+            self.add_property(self.stack[-1], statement)
+        elif statement == "/dts-v1/" or statement.startswith("/memreserve/"):
+            self.elements.append(statement)
+        elif statement:
+            raise PrescanError("unsupported top-level statement '%s'" % statement)
+
+    def open_node(self, header):
+        """Create the node instance opened by a header"""
+        if not self.stack:
+            if header == "/":
+                node = RawNode("/")
+            elif header.startswith("&"):
+                node = RawNode("", reference=header)
+            else:
+                raise PrescanError("unsupported top-level node '%s'" % header)
+            self.elements.append(node)
+            return node
+
+        labels = []
+        match = LABEL_RE.match(header)
+        while match:
+            labels.append(match.group(1))
+            header = header[match.end():]
+            match = LABEL_RE.match(header)
+        if not header or header.startswith("/"):
+            raise PrescanError("unsupported node header '%s'" % header)
+
+        parent = self.stack[-1]
+        node = RawNode(header, parent)
+        node.labels = labels
+        parent.children.append(node)
+        return node
+
+    @staticmethod
+    def add_property(node, statement):
+        """Record the source of a property of the node"""
+        if not statement:
+            return
+        if statement.startswith("/"):
+            raise PrescanError("unsupported directive '%s'" % statement)
+        name = statement.split("=", 1)[0].strip()
+        node.properties.append((name, statement))
+
+    def resolve(self, reference):
+        """Get the node a label or path reference points at"""
+        node = find_node(self.root.walk(), reference)
+        if node is None:
+            raise PrescanError("can't resolve reference %s" % reference)
+        return node
+
+
+def find_node(nodes, reference):
+    """Find the first of the nodes which a label or path reference points at"""
+    path = PATH_REF_RE.match(reference)
+    nodes = list(nodes)
+    if path:
+        for address in (True, False):
+            for node in nodes:
+                if node.reference is None and node.get_path(address) == path.group(1):
+                    return node
+        return None
+    for node in nodes:
+        if reference[1:] in node.labels:
+            return node
+    return None
+
+
+def resolve_references(elements):
+    """Move the contents of the top-level references into the node instances
+       they refer to, in order, as pydevicetree does before merging"""
+    nodes = [element for element in elements if isinstance(element, RawNode)]
+    for reference in [node for node in nodes if node.reference is not None]:
+        target = find_node((n for top in nodes for n in top.walk()), reference.reference)
+        if target is None:
+            raise PrescanError("can't resolve reference %s" % reference.reference)
+        nodes.remove(reference)
+        target.properties += reference.properties
+        for child in reference.children:
+            child.parent = target
+        target.children += reference.children
+    return nodes
+
+
+def merge_nodes(instances, parent=None):
+    """Merge the instances of a node into a single node. The properties and
+       children of each instance follow those of the instances before it."""
+    node = RawNode(instances[0].name, parent)
+    # Keep the children in the order they were first defined
+    children = collections.OrderedDict()
+    for instance in instances:
+        node.labels += [label for label in instance.labels if label not in node.labels]
+        node.properties += instance.properties
+        for child in instance.children:
+            children.setdefault(child.name, []).append(child)
+    node.children = [merge_nodes(group, node) for group in children.values()]
+    return node
+
+
+def is_relevant(node):
+    """Test if the memory map needs the node"""
+    name = node.name.split("@")[0]
+    if RAM_NODE_RE.search(name) or name == "memory":
+        return True
+    return any(prop_name == "compatible" and COMPATIBLE_RE.search(source)
+               for prop_name, source in node.properties)
+
+
+def get_references(statement):
+    """Get the references made by the value of a property"""
+    value = STRING_RE.sub("", statement.split("=", 1)[1]) if "=" in statement else ""
+    return ["&" + label for label in LABEL_REF_RE.findall(value)] + \
+        ["&{%s}" % path for path in PATH_REF_RE.findall(value)]
+
+
+def select_nodes(scanner):
+    """Get the set of nodes to keep whole: the relevant nodes and every node
+       they reference, recursively"""
+    pending = []
+    for path in KEPT_PATHS:
+        node = scanner.root.get_child(path[1:])
+        if node:
+            pending += list(node.walk())
+    pending += [node for node in scanner.root.walk() if is_relevant(node)]
+
+    kept = set()
+    while pending:
+        node = pending.pop()
+        if node in kept:
+            continue
+        kept.add(node)
+        for _, statement in node.properties:
+            pending += [scanner.resolve(r) for r in get_references(statement)]
+    return kept
+
+
+def format_node(node, kept, ancestors, level):
+    """Format the kept nodes below the node as Devicetree source. Ancestors
+       of kept nodes only keep the properties describing the address space,
+       except for the root node, which keeps all of them."""
+    indent = "\t" * level
+    out = ""
+    if node.parent is None:
+        out += "/ {\n"
+    else:
+        labels = "".join("%s: " % label for label in node.labels)
+        out += "%s%s%s {\n" % (indent, labels, node.name)
+
+    for name, statement in node.properties:
+        if node in kept or name in STRUCTURAL_PROPERTIES or node.parent is None:
+            out += "%s\t%s;\n" % (indent, statement)
+    for child in node.children:
+        if child in kept or child in ancestors:
+            out += format_node(child, kept, ancestors, level + 1)
+
+    out += "%s};\n" % indent
+    return out
+
+
+def get_subset_source(path):
+    """Get the Devicetree source of the subset of the Devicetree which the
+       memory map depends on. Raises PrescanError if it can't be built."""
+    scanner = Scanner()
+    scanner.scan(path)
+
+    kept = select_nodes(scanner)
+    ancestors = set()
+    for node in kept:
+        node = node.parent
+        while node is not None and node not in ancestors:
+            ancestors.add(node)
+            node = node.parent
+
+    return "/dts-v1/;\n" + format_node(scanner.root, kept, ancestors, 0)
+
+
+def parse_devicetree(path, full=False):
+    """Parse the Devicetree at the path, only building the subset of the
+       tree which the memory map depends on unless a full parse is requested
+       or the subset can't be built"""
+    if not full:
+        try:
+            return pydevicetree.Devicetree.from_dts(get_subset_source(path))
+        except Exception as error: # pylint: disable=broad-except
+            # Besides PrescanError, pydevicetree raises bare Exceptions and
+            # pyparsing errors for source it can't handle
+            LOGGER.debug("Parsing the whole Devicetree: %s", error)
+
+    return pydevicetree.Devicetree.parseFile(path, followIncludes=True)
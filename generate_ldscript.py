@@ -5,19 +5,34 @@
 """Generate linker scripts from devicetree source files"""
 
 import argparse
+import functools
+import importlib.util
+import json
+import logging
+import os
 import sys
 
 import jinja2
-import pydevicetree
 
-from memory_map import get_memories, get_ram_memories, get_load_map
+from dts_prescan import parse_devicetree
+from manifest import get_manifest, hash_templates, write_manifest
+from memory_map import get_memories, get_ram_memories, get_load_map, get_cache_geometry
 
 TEMPLATES_PATH = "templates"
 
+# Name of the function a layout hook module defines to add template values
+LAYOUT_HOOK_FUNCTION = "layout_values"
+
+LOGGER = logging.getLogger("ldscript_generator")
+
 # Sets the threshold size of the ITIM at or above which the "ramrodata" layout
 # places the text section into the ITIM
 MAGIC_RAMRODATA_TEXT_THRESHOLD = 0x8000
 
+# Default sizes of the stack of each hart and of the heap
+DEFAULT_STACK_SIZE = 0x400
+DEFAULT_HEAP_SIZE = 0x800
+
 
 def missingvalue(message):
     """
@@ -29,6 +44,83 @@ def missingvalue(message):
     raise jinja2.UndefinedError(message)
 
 
+class TextFormatter(logging.Formatter):
+    """Format log records as the plain progress messages, prefixing
+       warnings and errors with their level"""
+    def format(self, record):
+        message = super().format(record)
+        if record.levelno >= logging.WARNING:
+            return "%s: %s" % (record.levelname, message)
+        return message
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Format log records as one JSON object per line. Records logged with
+       an "event" extra become that event with its "data", warnings and
+       errors become "warning" and "error" events with their message"""
+    def __init__(self, target):
+        super().__init__()
+        self.target = target
+
+    def format(self, record):
+        event = {
+            "target": self.target,
+            "level": record.levelname.lower(),
+            "event": getattr(record, "event", record.levelname.lower()),
+        }
+        if hasattr(record, "data"):
+            event.update(record.data)
+        else:
+            event["message"] = record.getMessage()
+        return json.dumps(event, sort_keys=True)
+
+
+def setup_logging(quiet, verbose, log_json, target):
+    """Send progress messages to stderr and, if log_json is given, structured
+       events about the target Devicetree to a JSON lines file. When neither
+       is enabled the logger is disabled below WARNING so that reporting
+       costs nothing."""
+    for handler in list(LOGGER.handlers):
+        LOGGER.removeHandler(handler)
+        handler.close()
+    LOGGER.propagate = False
+
+    if quiet:
+        text_level = logging.WARNING
+    elif verbose:
+        text_level = logging.DEBUG
+    else:
+        text_level = logging.INFO
+    text_handler = logging.StreamHandler(sys.stderr)
+    text_handler.setLevel(text_level)
+    text_handler.setFormatter(TextFormatter())
+    LOGGER.addHandler(text_handler)
+    level = text_level
+
+    if log_json:
+        json_handler = logging.FileHandler(log_json, mode="w")
+        json_handler.setLevel(logging.INFO)
+        json_handler.setFormatter(JsonLinesFormatter(target))
+        LOGGER.addHandler(json_handler)
+        level = min(level, logging.INFO)
+
+    LOGGER.setLevel(level)
+
+
+def log_event(event, message, data):
+    """Log a structured event, with a human-readable message for stderr"""
+    LOGGER.info(message, extra={"event": event, "data": data})
+
+
+def describe_regions(memories):
+    """Describe the memories for structured events"""
+    return [{
+        "name": memory["name"],
+        "base": memory["base"],
+        "length": memory["length"],
+    } for memory in sorted(memories, key=lambda m: m["name"])]
+
+
 def parse_arguments(argv):
     """Parse the arguments into a dictionary with argparse"""
     arg_parser = argparse.ArgumentParser(
@@ -37,8 +129,10 @@ def parse_arguments(argv):
     arg_parser.add_argument("-d", "--dts", required=True,
                             help="The path to the Devicetree for the target")
     arg_parser.add_argument("-o", "--output",
-                            type=argparse.FileType('w'),
                             help="The path of the linker script file to output")
+    arg_parser.add_argument("--manifest",
+                            help="The path of a JSON manifest to write, describing the hashes "
+                            "of the inputs and the output")
     group = arg_parser.add_mutually_exclusive_group()
     group.add_argument("--scratchpad", action="store_true",
                        help="Emits a linker script with the scratchpad layout")
@@ -46,42 +140,129 @@ def parse_arguments(argv):
                        help="Emits a linker script with the ramrodata layout")
     group.add_argument("--freertos", action="store_true",
                        help="Emits a linker script with specific layout for freertos")
+    group.add_argument("--layout",
+                       help="Emits a linker script with the named layout, which is "
+                       "looked up in the template paths before the built-in layouts")
+    arg_parser.add_argument("-T", "--template-path", action="append", default=[],
+                            help="Additional directory to search for layouts, "
+                            "may be given more than once")
+    arg_parser.add_argument("--full-parse", action="store_true",
+                            help="Parse the whole Devicetree instead of only the nodes "
+                            "the memory map depends on")
+    arg_parser.add_argument("--cache-aware", action="store_true",
+                            help="Align hot sections and per-hart stacks to the cache geometry")
+    verbosity = arg_parser.add_mutually_exclusive_group()
+    verbosity.add_argument("-q", "--quiet", action="store_true",
+                           help="Only report warnings and errors, for batch generation")
+    verbosity.add_argument("-v", "--verbose", action="store_true",
+                           help="Also report debugging messages")
+    arg_parser.add_argument("--log-json",
+                            help="The path of a file to write structured events to, "
+                            "as one JSON object per line")
 
     return arg_parser.parse_args(argv)
 
 
-def get_template(parsed_args):
-    """Initialize jinja2 and return the right template"""
+def get_layout(parsed_args):
+    """Get the name of the layout requested by the arguments"""
+    if parsed_args.layout:
+        return parsed_args.layout
+    if parsed_args.ramrodata:
+        return "ramrodata"
+    if parsed_args.scratchpad:
+        return "scratchpad"
+    if parsed_args.freertos:
+        return "freertos"
+    return "default"
+
+
+@functools.lru_cache(maxsize=None)
+def get_environment(template_paths=()):
+    """Initialize jinja2 with the additional template paths searched before
+       the built-in templates. The environment is shared by every caller
+       with the same template paths so that templates are only compiled
+       once."""
+    loaders = [jinja2.FileSystemLoader(list(template_paths))] if template_paths else []
+    loaders.append(jinja2.PackageLoader(__name__, TEMPLATES_PATH))
+
     env = jinja2.Environment(
-        loader=jinja2.PackageLoader(__name__, TEMPLATES_PATH),
+        loader=jinja2.ChoiceLoader(loaders),
         trim_blocks=True, lstrip_blocks=True,
     )
     # Make the missingvalue() function available in the template so that the
     # template fails to render if we don't provide the values it needs.
     env.globals["missingvalue"] = missingvalue
 
-    if parsed_args.ramrodata:
-        layout = "ramrodata"
-    elif parsed_args.scratchpad:
-        layout = "scratchpad"
-    elif parsed_args.freertos:
-        layout = "freertos"
-    else:
-        layout = "default"
+    return env
+
+
+@functools.lru_cache(maxsize=None)
+def get_layout_hook(template_filename):
+    """Get the function which a layout declares in <layout>.py, in the same
+       directory as the template it was loaded from, to add values to the
+       template context. Returns the function and the path of the file
+       declaring it, or (None, None) if the layout doesn't have one."""
+    hook_path = "%s.py" % os.path.splitext(template_filename)[0]
+    if not os.path.isfile(hook_path):
+        return None, None
+    name = os.path.splitext(os.path.basename(hook_path))[0]
+    spec = importlib.util.spec_from_file_location("layout_%s" % name, hook_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    hook = getattr(module, LAYOUT_HOOK_FUNCTION, None)
+    if hook is None:
+        return None, None
+    return hook, hook_path
+
+
+def get_layout_options(env, template_name):
+    """Get the layout options, such as ramrodata, which a layout template
+       and the templates it extends set to constants at the top level. The
+       options set by a template take precedence over the templates it
+       extends."""
+    ast = env.parse(env.loader.get_source(env, template_name)[0])
+    options = {}
+    extends = ast.find(jinja2.nodes.Extends)
+    if extends and isinstance(extends.template, jinja2.nodes.Const):
+        options.update(get_layout_options(env, extends.template.value))
+    for node in ast.body:
+        if isinstance(node, jinja2.nodes.Assign) and \
+                isinstance(node.target, jinja2.nodes.Name) and \
+                isinstance(node.node, jinja2.nodes.Const):
+            options[node.target.name] = node.node.value
+    return options
+
+
+def get_template_name(parsed_args):
+    """Get the name of the template which renders the requested layout"""
+    return "%s.lds" % get_layout(parsed_args)
+
+
+def get_template(parsed_args):
+    """Initialize jinja2 and return the right template"""
+    env = get_environment(tuple(parsed_args.template_path))
+    layout = get_layout(parsed_args)
 
-    template = env.get_template("%s.lds" % layout)
-    print("Generating linker script with %s layout" % layout, file=sys.stderr)
+    try:
+        template = env.get_template(get_template_name(parsed_args))
+    except jinja2.TemplateNotFound:
+        LOGGER.error("layout %s was not found in the template paths", layout)
+        sys.exit(1)
+    log_event("layout", "Generating linker script with %s layout" % layout, {"layout": layout})
 
     return template
 
 
 def print_memories(memories):
-    """Report chosen memories to stdout"""
-    print("Using layout:", file=sys.stderr)
+    """Report chosen memories"""
+    if not LOGGER.isEnabledFor(logging.INFO):
+        return
+    message = "Using layout:"
     for _, memory in memories.items():
         end = memory["base"] + memory["length"] - 1
-        print("\t%4s: 0x%08x-0x%08x (%s)" %
-              (memory["name"], memory["base"], end, memory["path"]), file=sys.stderr)
+        message += "\n\t%4s: 0x%08x-0x%08x (%s)" % \
+            (memory["name"], memory["base"], end, memory["path"])
+    log_event("memories", message, {"regions": describe_regions(memories.values())})
 
 
 def get_itim_length(memories):
@@ -91,54 +272,104 @@ def get_itim_length(memories):
     return 0
 
 
+def get_text_in_itim(memories):
+    """Test if the ramrodata layout places the text section into the itim"""
+    return get_itim_length(memories) >= MAGIC_RAMRODATA_TEXT_THRESHOLD
+
+
 def get_sorted_ram_memories(dts):
     """Get a sorted RAM list"""
     ram_memories = get_ram_memories(dts)
     sorted_ram_list = list(ram_memories.values())
     sorted_ram_list.sort(key=lambda m: m["name"])
-    print("Consolidated RAM memories:", file=sys.stderr)
-    for memory in sorted_ram_list:
-        print("\t%4s: 0x%08x-0x%08x" %
-              (memory["name"], memory["base"], memory["length"]), file=sys.stderr)
+    if LOGGER.isEnabledFor(logging.INFO):
+        message = "Consolidated RAM memories:"
+        for memory in sorted_ram_list:
+            message += "\n\t%4s: 0x%08x-0x%08x" % \
+                (memory["name"], memory["base"], memory["length"])
+        log_event("ram_memories", message, {"regions": describe_regions(sorted_ram_list)})
     return sorted_ram_list
 
 
+def get_boot_hart(dts, harts):
+    """Get the hart which runs the pre-main initialization routines"""
+    chosenboothart = dts.chosen("metal,boothart")
+    is_worlguard = dts.match("sifive,worldguard1")
+    if is_worlguard:
+        return 0
+    if chosenboothart:
+        return dts.get_by_reference(chosenboothart[0]).get_reg()[0][0]
+    if len(harts) > 1:
+        return 1
+    return 0
+
+
+def write_output(parsed_args, script, hook_path, cache_aware):
+    """Write the linker script, and its manifest if requested. The script is
+       written as UTF-8 with the same bytes on every platform, whether to a
+       file or to stdout."""
+    if parsed_args.output:
+        with open(parsed_args.output, "w", encoding="utf-8", newline="\n") as output:
+            output.write(script)
+    else:
+        # Bypass the text layer of stdout, which translates newlines and
+        # encodes with the locale
+        sys.stdout.flush()
+        sys.stdout.buffer.write(script.encode("utf-8"))
+        sys.stdout.buffer.flush()
+
+    if parsed_args.manifest:
+        options = {
+            "layout": get_layout(parsed_args),
+            "cache_aware": cache_aware,
+        }
+        templates = hash_templates(get_environment(tuple(parsed_args.template_path)),
+                                   get_template_name(parsed_args), hook_path)
+        manifest = get_manifest(parsed_args.dts, templates, options, script)
+        write_manifest(parsed_args.manifest, manifest)
+
+
 def main(argv):
     """Parse arguments, extract data, and render the linker script to file"""
     # pylint: disable=too-many-locals
 
     parsed_args = parse_arguments(argv)
+    setup_logging(parsed_args.quiet, parsed_args.verbose, parsed_args.log_json, parsed_args.dts)
 
     template = get_template(parsed_args)
 
-    dts = pydevicetree.Devicetree.parseFile(
-        parsed_args.dts, followIncludes=True)
+    # A layout hook may look at any node, so it is given the whole Devicetree
+    layout_hook, hook_path = get_layout_hook(template.filename)
+    dts = parse_devicetree(parsed_args.dts, full=parsed_args.full_parse or bool(layout_hook))
 
     memories = get_memories(dts)
     print_memories(memories)
     sorted_ram_memories = get_sorted_ram_memories(dts)
 
-    ram, rom, itim, lim = get_load_map(memories, scratchpad=parsed_args.scratchpad)
+    options = get_layout_options(template.environment, template.name)
+    ram, rom, itim, lim = get_load_map(memories, scratchpad=options.get("scratchpad", False))
 
     text_in_itim = False
-    if parsed_args.ramrodata and get_itim_length(memories) >= MAGIC_RAMRODATA_TEXT_THRESHOLD:
+    if options.get("ramrodata") and get_text_in_itim(memories):
         text_in_itim = True
-        print(".text section included in ITIM", file=sys.stderr)
-    elif parsed_args.ramrodata:
-        print(".text section included in ROM", file=sys.stderr)
+        log_event("text", ".text section included in ITIM", {"text_in_itim": True})
+    elif options.get("ramrodata"):
+        log_event("text", ".text section included in ROM", {"text_in_itim": False})
 
     harts = dts.get_by_path("/cpus").children
-    chosenboothart = dts.chosen("metal,boothart")
-    is_worlguard = dts.match("sifive,worldguard1")
-    if is_worlguard:
-        boot_hart = 0
-    else:
-        if chosenboothart:
-            boot_hart = dts.get_by_reference(chosenboothart[0]).get_reg()[0][0]
-        elif len(harts) > 1:
-            boot_hart = 1
+    boot_hart = get_boot_hart(dts, harts)
+
+    # A layout may enable or disable the cache-aware mode itself
+    cache_aware = options.get("cache_aware", parsed_args.cache_aware)
+    cache = get_cache_geometry(dts)
+    if cache_aware:
+        if cache:
+            log_event("cache", "Aligning sections to %d-byte cache lines (%d sets)" %
+                      (cache["block_size"], cache["sets"]),
+                      {"block_size": cache["block_size"], "sets": cache["sets"]})
         else:
-            boot_hart = 0
+            LOGGER.warning("cache-aware layout requested but no cache geometry found in the "
+                           "Devicetree")
 
     if len(sorted_ram_memories) == 0:
         # If there are no rams to scrub, don't bother scrubbing them
@@ -157,24 +388,25 @@ def main(argv):
     values = {
         "memories": sorted_memories,
         "ram_memories": sorted_ram_memories,
-        "default_stack_size": "0x400",
-        "default_heap_size": "0x800",
+        "default_stack_size": "0x%x" % DEFAULT_STACK_SIZE,
+        "default_heap_size": "0x%x" % DEFAULT_HEAP_SIZE,
         "num_harts": len(harts),
         "boot_hart": boot_hart,
         "chicken_bit": 1,
         "eccscrub_bit": ecc_scrub,
         "text_in_itim": text_in_itim,
+        "cache_aware": cache_aware,
+        "cache": cache,
         "rom": rom,
         "itim": itim,
         "lim": lim,
         "ram": ram,
     }
 
-    if parsed_args.output:
-        parsed_args.output.write(template.render(values))
-        parsed_args.output.close()
-    else:
-        print(template.render(values))
+    if layout_hook:
+        values.update(layout_hook(dts, values))
+
+    write_output(parsed_args, template.render(values) + "\n", hook_path, cache_aware)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 SiFive Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+"""Functions for describing the inputs and output of a generated linker script,
+so that build caches can reuse it without rerunning the generator"""
+
+import hashlib
+import json
+import os
+import posixpath
+import re
+import subprocess
+
+import jinja2.meta
+
+TOOL_NAME = "ldscript-generator"
+TOOL_PATH = os.path.dirname(os.path.abspath(__file__))
+TOOL_SOURCES = ["dts_prescan.py", "generate_ldscript.py", "manifest.py", "memory_map.py"]
+
+INCLUDE_RE = re.compile(r'^\s*/include/\s+"([^"]+)"', re.MULTILINE)
+
+
+def hash_bytes(data):
+    """Get the hex SHA-256 of the data"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path):
+    """Get the hex SHA-256 of the contents of the file"""
+    with open(path, "rb") as source:
+        return hash_bytes(source.read())
+
+
+def get_include_files(dts_path):
+    """Given the path to a Devicetree, get the paths of it and every file it
+       /include/s, recursively, by name. As in pydevicetree, relative
+       includes are relative to the directory of the Devicetree, and are
+       named by that relative path. Absolute includes are named by their
+       file name under <absolute>/, so that the names don't depend on the
+       machine."""
+    dts_dir = os.path.dirname(dts_path)
+    files = {os.path.basename(dts_path): dts_path}
+    pending = [dts_path]
+    while pending:
+        with open(pending.pop(0), encoding="utf-8") as source:
+            contents = source.read()
+        for include in INCLUDE_RE.findall(contents):
+            path = os.path.join(dts_dir, include)
+            if os.path.isabs(include):
+                name = base_name = "<absolute>/%s" % posixpath.basename(include)
+            else:
+                name = base_name = posixpath.normpath(include)
+            count = 1
+            while name in files and files[name] != path:
+                count += 1
+                name = "%s#%d" % (base_name, count)
+            if name not in files:
+                files[name] = path
+                pending.append(path)
+    return files
+
+
+def get_template_names(env, name):
+    """Given a template, get the list of it and every template it extends,
+       includes or imports, recursively"""
+    names = [name]
+    source = env.loader.get_source(env, name)[0]
+    for referenced in jinja2.meta.find_referenced_templates(env.parse(source)):
+        if referenced is not None and referenced not in names:
+            names += [n for n in get_template_names(env, referenced) if n not in names]
+    return names
+
+
+def run_git(args):
+    """Run git in the generator's directory, returning its output or None if
+       it fails"""
+    try:
+        process = subprocess.run(["git"] + args, cwd=TOOL_PATH, check=False,
+                                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                 universal_newlines=True)
+    except OSError:
+        return None
+    if process.returncode != 0:
+        return None
+    return process.stdout.strip()
+
+
+def get_tool_version():
+    """Get the release tag of the generator from git, if it is run from its
+       own clone. A clone which the generator is vendored into, or one
+       without tags, such as a shallow clone, would describe the generator
+       differently from machine to machine, so its version is unknown and
+       tool.sha256 identifies it instead."""
+    toplevel = run_git(["rev-parse", "--show-toplevel"])
+    if toplevel is None or os.path.realpath(toplevel) != os.path.realpath(TOOL_PATH):
+        return "unknown"
+    return run_git(["describe", "--tags"]) or "unknown"
+
+
+def get_tool_hash():
+    """Get the hash of the generator sources and built-in templates, which
+       identifies the tool even when its version isn't known"""
+    sources = [os.path.join(TOOL_PATH, name) for name in TOOL_SOURCES]
+    templates = os.path.join(TOOL_PATH, "templates")
+    sources += sorted(os.path.join(templates, name) for name in os.listdir(templates)
+                      if name.endswith(".lds"))
+
+    digest = hashlib.sha256()
+    for source in sources:
+        digest.update(os.path.relpath(source, TOOL_PATH).encode("utf-8"))
+        digest.update(hash_file(source).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def hash_templates(env, template_name, hook_path=None):
+    """Get the hashes of the template, the templates it references and the
+       layout hook, by name"""
+    templates = {}
+    for name in get_template_names(env, template_name):
+        templates[name] = hash_bytes(env.loader.get_source(env, name)[0].encode("utf-8"))
+    if hook_path:
+        templates[os.path.basename(hook_path)] = hash_file(hook_path)
+    return templates
+
+
+def get_manifest(dts_path, templates, options, output):
+    """Describe the generation of a linker script. Devicetrees are recorded
+       by the names get_include_files() gives them, and templates by name,
+       so that the manifest doesn't depend on the machine it was generated
+       on"""
+    devicetrees = {}
+    for name, path in get_include_files(dts_path).items():
+        devicetrees[name] = hash_file(path)
+
+    return {
+        "tool": {
+            "name": TOOL_NAME,
+            "version": get_tool_version(),
+            "sha256": get_tool_hash(),
+        },
+        "inputs": {
+            "devicetrees": devicetrees,
+            "templates": templates,
+            "options": options,
+        },
+        "output": {
+            "sha256": hash_bytes(output.encode("utf-8")),
+        },
+    }
+
+
+def write_manifest(path, manifest):
+    """Write the manifest as canonical JSON"""
+    with open(path, "w", encoding="utf-8", newline="\n") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+        manifest_file.write("\n")
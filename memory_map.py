@@ -4,9 +4,12 @@
 
 """Functions for converting Devicetrees to the template parameterization"""
 
+import logging
 import re
 import sys
 
+LOGGER = logging.getLogger("ldscript_generator.memory_map")
+
 def get_ram_memories(tree):
     """Given a Devicetree, get the list of ram memories to describe in the
        linker script"""
@@ -161,6 +164,45 @@ def get_lim_region(dts):
         }
     return None
 
+def get_cache_geometry(tree):
+    """Given a Devicetree, get the cache line size and number of sets used
+       to align sections in the cache-aware layout. The shared cache
+       controller is preferred, falling back to the data cache of the first
+       hart, which is private to that hart. Returns None if the design
+       doesn't describe a usable cache"""
+    ccache = tree.match("sifive,ccache[01]")
+    if ccache:
+        block_size = ccache[0].get_field("cache-block-size")
+        sets = ccache[0].get_field("cache-sets")
+    else:
+        cpus = tree.get_by_path("/cpus")
+        harts = [node for node in cpus.children if node.get_field("device_type") == "cpu"] \
+                if cpus else []
+        if not harts:
+            return None
+        block_size = harts[0].get_field("d-cache-block-size")
+        sets = harts[0].get_field("d-cache-sets")
+
+    if not block_size or not sets:
+        return None
+    # Section alignment must stay a power of two no smaller than the 16 bytes
+    # the RISC-V ABI requires for the stack pointer
+    if block_size < 16 or block_size & (block_size - 1) != 0:
+        return None
+
+    cache = {
+        "block_size": block_size,
+        "sets": sets,
+        "way_size": block_size * sets,
+        # The stacks of different harts only compete for the sets of a cache
+        # shared between harts
+        "shared": bool(ccache),
+    }
+    cache["block_size_hex"] = "0x%x" % cache["block_size"]
+    cache["way_size_hex"] = "0x%x" % cache["way_size"]
+
+    return cache
+
 def get_chosen_regions(tree):
     """Given the tree, get the regions requested by chosen properties.
        Exits with an error if required properties are missing or the
@@ -173,10 +215,10 @@ def get_chosen_regions(tree):
     }
 
     if regions["entry"] is None:
-        print("ERROR: metal,entry is not defined by the Devicetree")
+        LOGGER.error("metal,entry is not defined by the Devicetree")
         sys.exit(1)
     if regions["ram"] is None:
-        print("ERROR: metal,ram is not defined by the Devicetree")
+        LOGGER.error("metal,ram is not defined by the Devicetree")
         sys.exit(1)
     return regions
 
@@ -185,11 +227,12 @@ def consolidate_address_ranges(regions):
     """Given the requested regions, consolidate the region address ranges
        if they are contiguous"""
     sorted_list = list(regions.values())
-    sorted_list.sort(key=lambda m: m["base"])
-    print("RAM memories:", file=sys.stderr)
-    for memory in sorted_list:
-        print("\t%4s: 0x%08x-0x%08x" %
-              (memory["name"], memory["base"], memory["length"]), file=sys.stderr)
+    # Break ties by name so that the order doesn't depend on dict ordering
+    sorted_list.sort(key=lambda m: (m["base"], m["name"]))
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug("RAM memories:%s", "".join(
+            "\n\t%4s: 0x%08x-0x%08x" % (memory["name"], memory["base"], memory["length"])
+            for memory in sorted_list))
 
     removal_list = []
     base = dict()
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 SiFive Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+"""Compare the memory maps of variants of a Devicetree
+
+The base Devicetree is parsed once. Each variant swaps its overridden
+properties into the parsed tree, evaluates the memories and load map the
+linker script would be generated from, and then restores the original
+properties, so that many variants can be compared without reparsing.
+"""
+
+import argparse
+import collections
+import contextlib
+import csv
+import functools
+import itertools
+import logging
+import sys
+
+import pydevicetree
+
+from dts_prescan import get_references, parse_devicetree
+from generate_ldscript import DEFAULT_HEAP_SIZE, DEFAULT_STACK_SIZE, get_text_in_itim, \
+    log_event, setup_logging
+from memory_map import get_memories, get_load_map
+
+LOGGER = logging.getLogger("ldscript_generator.sweep")
+
+# Pseudo-properties which are computed from the node instead of replacing
+# the property of the same name
+LENGTH_PROPERTY = "length"
+WAYS_PROPERTY = "ways"
+
+Override = collections.namedtuple("Override", ["target", "name", "values"])
+
+
+class SweepError(Exception):
+    """An override can't be applied to the Devicetree"""
+
+
+def parse_override(spec):
+    """Parse an override of the form TARGET:PROPERTY=VALUE[|VALUE...], where
+       TARGET is a &label or a /path to a node"""
+    target, colon, rest = spec.partition(":")
+    name, equals, values = rest.partition("=")
+    if not colon or not equals or not target.startswith(("&", "/")) or not name.strip():
+        raise SweepError("invalid override '%s', expected TARGET:PROPERTY=VALUE[|VALUE...]"
+                         % spec)
+    values = [value.strip() for value in values.split("|")]
+    if not all(values):
+        raise SweepError("override '%s' has an empty value" % spec)
+    return Override(target, name.strip(), values)
+
+
+def get_override_references(overrides):
+    """Get the nodes the overrides target or refer to, as &label, &{/path}
+       or /path"""
+    references = set()
+    for override in overrides:
+        references.add(override.target)
+        for value in override.values:
+            references.update(get_references("%s = %s;" % (override.name, value)))
+    return references
+
+
+def find_node(tree, reference):
+    """Get the node at the &label, &{/path} or /path, or None if there isn't
+       one"""
+    if reference.startswith("&{") and reference.endswith("}"):
+        return tree.get_by_path(reference[2:-1])
+    if reference.startswith("&"):
+        return tree.get_by_label(reference[1:])
+    return tree.get_by_path(reference)
+
+
+def load_devicetree(path, overrides, full=False):
+    """Parse the base Devicetree. The pre-scan only keeps the nodes the
+       memory map depends on, so the whole Devicetree is parsed if the
+       overrides refer to any other node."""
+    tree = parse_devicetree(path, full=full)
+    references = get_override_references(overrides)
+    if not full and any(find_node(tree, reference) is None for reference in references):
+        LOGGER.debug("Parsing the whole Devicetree for the nodes the overrides refer to")
+        tree = parse_devicetree(path, full=True)
+    for reference in sorted(references):
+        if find_node(tree, reference) is None:
+            raise SweepError("%s is not in the Devicetree" % reference)
+    return tree
+
+
+def get_node(tree, target):
+    """Get the node an override targets"""
+    node = find_node(tree, target)
+    if node is None:
+        raise SweepError("%s is not in the Devicetree" % target)
+    return node
+
+
+def parse_int(value):
+    """Parse the integer value of a pseudo-property"""
+    try:
+        return int(value, 0)
+    except ValueError as error:
+        raise SweepError("'%s' is not an integer" % value) from error
+
+
+@functools.lru_cache(maxsize=None)
+def parse_property(source):
+    """Parse the source of a property. Variants share the parsed properties,
+       so each distinct value is only parsed once."""
+    try:
+        return pydevicetree.Property.from_dts(source)
+    except Exception as error: # pylint: disable=broad-except
+        raise SweepError("can't parse '%s': %s" % (source, error)) from error
+
+
+def to_cells(value, count):
+    """Split the value into the given number of 32-bit cells"""
+    return ["0x%x" % ((value >> (32 * i)) & 0xffffffff) for i in reversed(range(count))]
+
+
+def get_property(node, name, value):
+    """Get the property which overrides the node with the value. The length
+       pseudo-property sets the size of the first region of the reg, and
+       the ways pseudo-property sets the size of a cache to that many
+       ways."""
+    if name == LENGTH_PROPERTY:
+        reg = node.get_fields("reg")
+        if reg is None:
+            raise SweepError("%s has no reg to set the length of" % node.get_path())
+        address_cells = node.address_cells()
+        size_cells = node.size_cells()
+        cells = ["0x%x" % cell for cell in reg.values]
+        cells[address_cells:address_cells + size_cells] = to_cells(parse_int(value), size_cells)
+        return parse_property("reg = <%s>;" % " ".join(cells))
+
+    if name == WAYS_PROPERTY:
+        block_size = node.get_field("cache-block-size")
+        sets = node.get_field("cache-sets")
+        if not block_size or not sets:
+            raise SweepError("%s doesn't describe the geometry of a cache" % node.get_path())
+        return parse_property("cache-size = <%d>;" % (parse_int(value) * sets * block_size))
+
+    return parse_property("%s = %s;" % (name, value))
+
+
+def get_changes(tree, overrides):
+    """Get the list of (node, properties) to sweep for each override, with
+       one property per value"""
+    changes = []
+    for override in overrides:
+        node = get_node(tree, override.target)
+        changes.append((node, [get_property(node, override.name, value)
+                               for value in override.values]))
+    return changes
+
+
+@contextlib.contextmanager
+def overridden(changes):
+    """Swap the (node, property) pairs into the tree, restoring the original
+       properties on exit"""
+    saved = [(node, node.properties) for node, _ in changes]
+    try:
+        for node, prop in changes:
+            node.properties = [prop] + [p for p in node.properties if p.name != prop.name]
+        yield
+    finally:
+        for node, properties in reversed(saved):
+            node.properties = properties
+
+
+def evaluate(tree, scratchpad=False):
+    """Evaluate the memory map of the tree as it currently stands"""
+    memories = get_memories(tree)
+    ram, rom, itim, lim = get_load_map(memories, scratchpad=scratchpad)
+    num_harts = len(tree.get_by_path("/cpus").children)
+
+    return {
+        "lengths": {name: memory["length"] for name, memory in memories.items()},
+        "itim": itim["vma"],
+        "lim": lim["vma"],
+        "text": "itim" if get_text_in_itim(memories) else rom["vma"],
+        "ram_free": memories[ram["vma"]]["length"] - num_harts * DEFAULT_STACK_SIZE -
+                    DEFAULT_HEAP_SIZE,
+    }
+
+
+def sweep(tree, overrides, scratchpad=False):
+    """Evaluate every combination of the override values. Returns a list of
+       (values, result) pairs in the order the overrides were given."""
+    changes = get_changes(tree, overrides)
+    results = []
+    for variant in itertools.product(*[range(len(override.values)) for override in overrides]):
+        with overridden([(node, properties[i])
+                         for (node, properties), i in zip(changes, variant)]):
+            result = evaluate(tree, scratchpad)
+        values = [override.values[i] for override, i in zip(overrides, variant)]
+        results.append((values, result))
+    return results
+
+
+def format_size(size):
+    """Format a possibly negative size in hex"""
+    return "-0x%x" % -size if size < 0 else "0x%x" % size
+
+
+def get_table(overrides, results):
+    """Get the header and rows comparing the results"""
+    names = sorted(set(name for _, result in results for name in result["lengths"]))
+    header = ["%s:%s" % (override.target, override.name) for override in overrides]
+    header += names + ["itim vma", "lim vma", "ramrodata .text", "ram free"]
+
+    rows = []
+    for values, result in results:
+        row = list(values)
+        row += [format_size(result["lengths"][name]) if name in result["lengths"] else "-"
+                for name in names]
+        row += [result["itim"], result["lim"], result["text"], format_size(result["ram_free"])]
+        rows.append(row)
+    return header, rows
+
+
+def write_table(output, header, rows):
+    """Write the rows as a table with aligned columns"""
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        output.write("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+        output.write("\n")
+
+
+def write_csv(output, header, rows):
+    """Write the rows as CSV"""
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow(header)
+    writer.writerows(rows)
+
+
+def parse_arguments(argv):
+    """Parse the arguments into a dictionary with argparse"""
+    arg_parser = argparse.ArgumentParser(
+        description="Compare the memory maps of variants of a Devicetree",
+        epilog="PROPERTY is either a Devicetree property, whose VALUE is Devicetree "
+        "source such as '<&L5 0 0>', or one of the pseudo-properties 'length', the "
+        "size of the first region of the reg of the node, and 'ways', the number of "
+        "ways of a cache controller.")
+
+    arg_parser.add_argument("-d", "--dts", required=True,
+                            help="The path to the base Devicetree")
+    arg_parser.add_argument("--vary", action="append", default=[],
+                            metavar="TARGET:PROPERTY=VALUE[|VALUE...]",
+                            help="Override a property of the node at the &label or /path "
+                            "TARGET with each of the values. Every combination of the "
+                            "overrides is evaluated.")
+    arg_parser.add_argument("--scratchpad", action="store_true",
+                            help="Evaluate the load map of the scratchpad layout")
+    arg_parser.add_argument("--format", choices=["table", "csv"], default="table",
+                            help="The format of the comparison")
+    arg_parser.add_argument("-o", "--output",
+                            help="The path of the file to write the comparison to")
+    arg_parser.add_argument("--full-parse", action="store_true",
+                            help="Parse the whole Devicetree instead of the subset the "
+                            "memory map depends on")
+    group = arg_parser.add_mutually_exclusive_group()
+    group.add_argument("-q", "--quiet", action="store_true",
+                       help="Only report warnings and errors")
+    group.add_argument("-v", "--verbose", action="store_true",
+                       help="Also report debug messages")
+
+    return arg_parser.parse_args(argv)
+
+
+def main(argv):
+    """Parse arguments, evaluate every variant, and write the comparison"""
+    parsed_args = parse_arguments(argv)
+    setup_logging(parsed_args.quiet, parsed_args.verbose, None, parsed_args.dts)
+
+    try:
+        overrides = [parse_override(spec) for spec in parsed_args.vary]
+        tree = load_devicetree(parsed_args.dts, overrides, full=parsed_args.full_parse)
+        results = sweep(tree, overrides, scratchpad=parsed_args.scratchpad)
+    except SweepError as error:
+        LOGGER.error("%s", error)
+        sys.exit(1)
+    log_event("sweep", "Evaluated %d variants" % len(results), {"variants": len(results)})
+
+    header, rows = get_table(overrides, results)
+    write = write_csv if parsed_args.format == "csv" else write_table
+    if parsed_args.output:
+        with open(parsed_args.output, "w", newline="\n") as output:
+            write(output, header, rows)
+    else:
+        write(sys.stdout, header, rows)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
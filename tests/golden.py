@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 SiFive Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+"""Render every golden case with generate_ldscript.py in parallel and compare
+the results against the expected linker scripts in tests/golden"""
+
+import argparse
+import collections
+import concurrent.futures
+import difflib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATOR = os.path.join(ROOT, "generate_ldscript.py")
+GOLDEN_PATH = os.path.join(ROOT, "tests", "golden")
+
+# Each case is (name, Devicetree, extra arguments). The expected output for a
+# case and layout lives in tests/golden/<name>/<layout>.lds
+CASES = [
+    ("spike", "tests/spike/design.dts", []),
+    ("e31", "tests/golden/e31/design.dts", []),
+    ("e31-large-itim", "tests/golden/e31-large-itim/design.dts", []),
+    ("u54mc", "tests/u54mc_ccache.dts", []),
+    ("u54mc-cache-aware", "tests/u54mc_ccache.dts", ["--cache-aware"]),
+]
+
+LAYOUTS = ["default", "scratchpad", "ramrodata", "freertos"]
+
+Result = collections.namedtuple(
+    "Result", ["case", "layout", "golden", "output", "expected", "returncode", "stderr", "seconds"])
+
+
+def golden_file(case, layout):
+    """Get the path of the expected output of a case"""
+    return os.path.join(GOLDEN_PATH, case, "%s.lds" % layout)
+
+
+def run_case(case, layout, outdir):
+    """Generate the linker script of a single case and layout"""
+    name, dts, extra_args = case
+    output = os.path.join(outdir, "%s.%s.lds" % (name, layout))
+    args = [sys.executable, GENERATOR, "--quiet", "-d", dts, "-o", output] + extra_args
+    if layout != "default":
+        args.append("--%s" % layout)
+
+    start = time.perf_counter()
+    process = subprocess.run(args, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True)
+    seconds = time.perf_counter() - start
+
+    text = None
+    if process.returncode == 0:
+        with open(output) as output_file:
+            text = output_file.read()
+
+    expected = None
+    golden = golden_file(name, layout)
+    if os.path.exists(golden):
+        with open(golden) as golden_fp:
+            expected = golden_fp.read()
+
+    return Result(name, layout, golden, text, expected, process.returncode, process.stderr,
+                  seconds)
+
+
+def run_matrix(jobs=None):
+    """Run every case with every layout in parallel, in a stable order"""
+    with tempfile.TemporaryDirectory() as outdir:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+            futures = [pool.submit(run_case, case, layout, outdir)
+                       for case in CASES for layout in LAYOUTS]
+            return [future.result() for future in futures]
+
+
+def diff_result(result):
+    """Get a unified diff between the expected and generated output"""
+    return "".join(difflib.unified_diff(
+        (result.expected or "").splitlines(True), (result.output or "").splitlines(True),
+        fromfile=os.path.relpath(result.golden, ROOT), tofile="generated"))
+
+
+def write_timings(results, path):
+    """Record the per-case timings as JSON"""
+    timings = {
+        "%s/%s" % (result.case, result.layout): round(result.seconds, 4)
+        for result in results
+    }
+    with open(path, "w") as timings_file:
+        json.dump(timings, timings_file, indent=2, sort_keys=True)
+        timings_file.write("\n")
+
+
+def parse_arguments(argv):
+    """Parse the arguments into a dictionary with argparse"""
+    arg_parser = argparse.ArgumentParser(
+        description="Check generated linker scripts against the golden corpus")
+
+    arg_parser.add_argument("--update", action="store_true",
+                            help="Overwrite the golden outputs with the generated ones")
+    arg_parser.add_argument("-j", "--jobs", type=int,
+                            help="Number of cases to run in parallel")
+    arg_parser.add_argument("--timings",
+                            help="The path of a JSON file to record per-case timings into")
+
+    return arg_parser.parse_args(argv)
+
+
+def main(argv):
+    """Run the golden corpus and report differences"""
+    parsed_args = parse_arguments(argv)
+
+    results = run_matrix(parsed_args.jobs)
+
+    failures = 0
+    for result in results:
+        status = "ok"
+        if result.returncode != 0:
+            status = "ERROR"
+            print(result.stderr, file=sys.stderr)
+        elif parsed_args.update:
+            if result.output != result.expected:
+                os.makedirs(os.path.dirname(result.golden), exist_ok=True)
+                with open(result.golden, "w") as golden_fp:
+                    golden_fp.write(result.output)
+                status = "updated"
+        elif result.output != result.expected:
+            status = "FAIL"
+            print(diff_result(result), file=sys.stderr)
+
+        if status in ("ERROR", "FAIL"):
+            failures += 1
+        print("%-20s %-10s %7.3fs %s" % (result.case, result.layout, result.seconds, status))
+
+    if parsed_args.timings:
+        write_timings(results, parsed_args.timings)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
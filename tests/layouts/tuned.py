@@ -0,0 +1,10 @@
+# Copyright (c) 2020 SiFive Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+"""Template values for the tuned example layout"""
+
+
+def layout_values(dts, values):
+    """Give each hart 4KiB of stack"""
+    # pylint: disable=unused-argument
+    return {"default_stack_size": "0x1000"}
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 SiFive Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+
+from tests.golden import run_matrix, diff_result
+
+
+class TestGolden(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.results = run_matrix()
+
+    def test_golden_outputs(self):
+        for result in self.results:
+            with self.subTest(case=result.case, layout=result.layout):
+                self.assertEqual(result.returncode, 0, result.stderr)
+                self.assertIsNotNone(result.expected, "Missing golden output %s" % result.golden)
+                self.assertTrue(result.output == result.expected, diff_result(result))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 SiFive Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import tempfile
+import unittest
+
+from generate_ldscript import *
+
+E31 = "tests/golden/e31/design.dts"
+
+
+class TestLayouts(unittest.TestCase):
+    def setUp(self):
+        self.outdir = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.outdir.name, "out.lds")
+
+    def tearDown(self):
+        self.outdir.cleanup()
+
+    def render(self, args):
+        main(["-d", "tests/u54mc_ccache.dts", "-o", self.output] + args)
+        with open(self.output) as output:
+            return output.read()
+
+    def test_get_layout(self):
+        self.assertEqual(get_layout(parse_arguments(["-d", "x"])), "default")
+        self.assertEqual(get_layout(parse_arguments(["-d", "x", "--ramrodata"])), "ramrodata")
+        self.assertEqual(get_layout(parse_arguments(["-d", "x", "--layout", "tuned"])), "tuned")
+
+    def test_layout_flags_are_exclusive(self):
+        with self.assertRaises(SystemExit):
+            parse_arguments(["-d", "x", "--scratchpad", "--layout", "tuned"])
+
+    def test_get_environment_is_shared(self):
+        self.assertIs(get_environment(("tests/layouts",)), get_environment(("tests/layouts",)))
+        self.assertIsNot(get_environment(("tests/layouts",)), get_environment())
+
+    def test_get_layout_hook(self):
+        env = get_environment(("tests/layouts",))
+        self.assertEqual(get_layout_hook(env.get_template("default.lds").filename),
+                         (None, None))
+        hook, hook_path = get_layout_hook(env.get_template("tuned.lds").filename)
+        self.assertEqual(hook(None, {}), {"default_stack_size": "0x1000"})
+        self.assertEqual(os.path.normpath(hook_path), os.path.normpath("tests/layouts/tuned.py"))
+
+    def test_layout_hook_from_template_directory(self):
+        # A hook only applies to the template next to it, not to a template
+        # of the same name found earlier in the template paths
+        first = os.path.join(self.outdir.name, "first")
+        os.mkdir(first)
+        with open(os.path.join(first, "tuned.lds"), "w") as template:
+            template.write('{% extends "default.lds" %}\n')
+
+        env = get_environment((first, "tests/layouts"))
+        self.assertEqual(get_layout_hook(env.get_template("tuned.lds").filename), (None, None))
+        self.assertIn("__stack_size : 0x400;",
+                      self.render(["-T", first, "-T", "tests/layouts", "--layout", "tuned"]))
+
+    def test_layout_hook_gets_whole_devicetree(self):
+        # The pre-scan leaves out the CLINT, but a hook may look at any node
+        with open(os.path.join(self.outdir.name, "probe.lds"), "w") as template:
+            template.write('{% extends "default.lds" %}\n')
+        with open(os.path.join(self.outdir.name, "probe.py"), "w") as hook:
+            hook.write("def layout_values(dts, values):\n"
+                       "    clint = dts.get_by_path('/soc/clint@2000000')\n"
+                       "    return {'default_stack_size': '0x800' if clint else '0x100'}\n")
+
+        self.assertIsNone(parse_devicetree(E31).get_by_path("/soc/clint@2000000"))
+        main(["-d", E31, "-o", self.output, "-T", self.outdir.name, "--layout", "probe"])
+        with open(self.output) as output:
+            self.assertIn("__stack_size : 0x800;", output.read())
+
+    def test_get_layout_options(self):
+        env = get_environment(("tests/layouts",))
+        self.assertEqual(get_layout_options(env, "scratchpad.lds"),
+                         {"ramrodata": False, "scratchpad": True, "eccscrub_en": False})
+        self.assertEqual(get_layout_options(env, "tuned.lds"),
+                         {"ramrodata": True, "eccscrub_en": False, "cache_aware": True})
+
+    def test_custom_layout_options(self):
+        # Layouts which only extend a built-in layout render the same script,
+        # including the scratchpad load map and .text in a large ITIM
+        for layout, dts in [("scratchpad", "tests/u54mc_ccache.dts"),
+                            ("ramrodata", "tests/golden/e31-large-itim/design.dts")]:
+            with self.subTest(layout=layout):
+                with open(os.path.join(self.outdir.name, "mine.lds"), "w") as template:
+                    template.write('{%% extends "%s.lds" %%}\n' % layout)
+                args = ["-d", dts, "-o", self.output]
+                main(args + ["-T", self.outdir.name, "--layout", "mine"])
+                with open(self.output) as output:
+                    custom = output.read()
+                main(args + ["--%s" % layout])
+                with open(self.output) as output:
+                    self.assertEqual(custom, output.read())
+
+    def test_builtin_layout_by_name(self):
+        self.assertEqual(self.render(["--layout", "scratchpad"]),
+                         self.render(["--scratchpad"]))
+
+    def test_builtin_layout_with_template_path(self):
+        self.assertEqual(self.render(["-T", "tests/layouts", "--freertos"]),
+                         self.render(["--freertos"]))
+
+    def test_custom_layout(self):
+        script = self.render(["-T", "tests/layouts", "--layout", "tuned"])
+
+        self.assertIn("Tuned Linker Script", script)
+        self.assertIn("__stack_size : 0x1000;", script)
+        self.assertIn(".data : ALIGN(0x40)", script)
+
+    def render_stacks(self, cache):
+        values = {
+            "memories": [{"name": "ram", "attributes": "rwxa", "base_hex": "0x80000000",
+                          "length_hex": "0x10000"}],
+            "ram_memories": [],
+            "num_harts": 4,
+            "cache_aware": True,
+            "cache": cache,
+            "rom": {"vma": "ram"},
+            "itim": {"lma": "ram", "vma": "ram"},
+            "lim": {"lma": "ram", "vma": "ram"},
+            "ram": {"lma": "ram", "vma": "ram"},
+        }
+        return get_environment().get_template("default.lds").render(values)
+
+    def test_stack_stride_padding(self):
+        cache = get_cache_geometry(parse_devicetree("tests/u54mc_ccache.dts"))
+        script = self.render_stacks(cache)
+
+        self.assertIn("__stack_size = ALIGN(__stack_size, 0x40);", script)
+        # Any two of the four harts' stacks may be 1, 2 or 3 strides apart
+        self.assertIn("__stack_size = (((__stack_size * 1) % 0x10000) == 0 || "
+                      "((__stack_size * 2) % 0x10000) == 0 || "
+                      "((__stack_size * 3) % 0x10000) == 0) ? __stack_size + 0x40 : __stack_size;",
+                      script)
+
+    def test_stack_stride_private_cache(self):
+        cache = dict(get_cache_geometry(parse_devicetree("tests/u54mc_ccache.dts")),
+                     shared=False)
+        script = self.render_stacks(cache)
+
+        # Stacks stay line aligned, but a private cache needs no padding
+        self.assertIn("__stack_size = ALIGN(__stack_size, 0x40);", script)
+        self.assertNotIn("__stack_size + 0x40", script)
+
+    def test_missing_layout(self):
+        with self.assertRaises(SystemExit):
+            self.render(["--layout", "missing"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 SiFive Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+import contextlib
+import io
+import json
+import logging
+import os
+import tempfile
+import unittest
+
+from generate_ldscript import *
+
+
+class TestLogging(unittest.TestCase):
+    def setUp(self):
+        self.outdir = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.outdir.name, "out.lds")
+        self.events = os.path.join(self.outdir.name, "events.jsonl")
+
+    def tearDown(self):
+        setup_logging(True, False, None, "x")
+        self.outdir.cleanup()
+
+    def generate(self, args):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            main(["-o", self.output] + args)
+        return stderr.getvalue()
+
+    def read_events(self):
+        with open(self.events) as events:
+            return [json.loads(line) for line in events]
+
+    def test_default_reports_progress(self):
+        stderr = self.generate(["-d", "tests/spike/design.dts"])
+
+        self.assertIn("Generating linker script with default layout", stderr)
+        self.assertIn("Using layout:", stderr)
+        self.assertNotIn("\nRAM memories:", stderr)
+
+    def test_verbose(self):
+        stderr = self.generate(["-d", "tests/spike/design.dts", "-v"])
+
+        self.assertIn("\nRAM memories:", stderr)
+
+    def test_quiet(self):
+        stderr = self.generate(["-d", "tests/spike/design.dts", "-q", "--cache-aware"])
+
+        self.assertNotIn("Generating linker script", stderr)
+        self.assertIn("WARNING: cache-aware layout requested but no cache geometry "
+                      "found in the Devicetree\n", stderr)
+        self.assertFalse(LOGGER.isEnabledFor(logging.INFO))
+
+    def test_layout_enables_cache_aware(self):
+        stderr = self.generate(["-d", "tests/spike/design.dts", "-q",
+                                "-T", "tests/layouts", "--layout", "tuned"])
+
+        self.assertIn("WARNING: cache-aware layout requested", stderr)
+
+    def test_json_events(self):
+        stderr = self.generate(["-d", "tests/u54mc_ccache.dts", "-q", "--ramrodata",
+                                "--log-json", self.events])
+        events = self.read_events()
+
+        self.assertNotIn("Generating linker script", stderr)
+        self.assertEqual([e["event"] for e in events],
+                         ["layout", "memories", "ram_memories", "text"])
+        self.assertTrue(all(e["target"] == "tests/u54mc_ccache.dts" for e in events))
+        self.assertEqual(events[0]["layout"], "ramrodata")
+        self.assertEqual(events[1]["regions"][0],
+                         {"name": "lim", "base": 0x8000000, "length": 0x1f0000})
+        self.assertFalse(events[3]["text_in_itim"])
+
+    def test_json_warnings(self):
+        self.generate(["-d", "tests/spike/design.dts", "-q", "--cache-aware",
+                       "--log-json", self.events])
+        warnings = [e for e in self.read_events() if e["level"] == "warning"]
+
+        self.assertEqual(len(warnings), 1)
+        self.assertEqual(warnings[0]["event"], "warning")
+        self.assertIn("cache-aware layout requested", warnings[0]["message"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 SiFive Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+import contextlib
+import io
+import json
+import os
+import subprocess
+import tempfile
+import unittest
+
+from generate_ldscript import main, get_environment
+import manifest
+from manifest import *
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.outdir = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.outdir.name, "out.lds")
+        self.manifest = os.path.join(self.outdir.name, "out.json")
+
+    def tearDown(self):
+        self.outdir.cleanup()
+
+    def generate(self, dts, args=None):
+        main(["-d", dts, "-o", self.output, "--manifest", self.manifest] + (args or []))
+        with open(self.output, "rb") as output:
+            script = output.read()
+        with open(self.manifest) as manifest:
+            return script, json.load(manifest)
+
+    def test_get_include_files(self):
+        self.assertEqual(get_include_files("tests/golden/e31/design.dts"), {
+            "design.dts": "tests/golden/e31/design.dts",
+            "../../e31_no_chosen.dts": "tests/golden/e31/../../e31_no_chosen.dts",
+        })
+
+    def test_absolute_include(self):
+        base = os.path.abspath("tests/e31_no_chosen.dts")
+        dts = os.path.join(self.outdir.name, "design.dts")
+        with open(dts, "w") as design:
+            design.write('/include/ "%s"\n' % base)
+            with open("tests/golden/e31/design.dts") as e31:
+                design.write(e31.read().split("\n", 1)[1])
+
+        _, manifest = self.generate(dts)
+
+        self.assertEqual(manifest["inputs"]["devicetrees"], {
+            "design.dts": hash_file(dts),
+            "<absolute>/e31_no_chosen.dts": hash_file(base),
+        })
+
+    def test_get_template_names(self):
+        env = get_environment(("tests/layouts",))
+        self.assertEqual(get_template_names(env, "tuned.lds"), ["tuned.lds", "base.lds"])
+
+    def test_manifest(self):
+        script, manifest = self.generate("tests/golden/e31/design.dts")
+
+        self.assertEqual(manifest["output"]["sha256"], hash_bytes(script))
+        self.assertEqual(sorted(manifest["inputs"]["devicetrees"]),
+                         ["../../e31_no_chosen.dts", "design.dts"])
+        self.assertEqual(manifest["inputs"]["devicetrees"]["design.dts"],
+                         hash_file("tests/golden/e31/design.dts"))
+        self.assertEqual(sorted(manifest["inputs"]["templates"]), ["base.lds", "default.lds"])
+        self.assertEqual(manifest["inputs"]["options"],
+                         {"layout": "default", "cache_aware": False})
+        self.assertEqual(manifest["tool"]["name"], "ldscript-generator")
+
+    def test_manifest_layout_hook(self):
+        _, manifest = self.generate("tests/u54mc_ccache.dts",
+                                    ["-T", "tests/layouts", "--layout", "tuned"])
+
+        self.assertEqual(manifest["inputs"]["templates"]["tuned.py"],
+                         hash_file("tests/layouts/tuned.py"))
+        # The layout enables the cache-aware mode itself
+        self.assertTrue(manifest["inputs"]["options"]["cache_aware"])
+
+    def test_manifest_partial_layout_hook(self):
+        layouts = os.path.join(self.outdir.name, "layouts")
+        os.mkdir(layouts)
+        with open(os.path.join(layouts, "partial.lds"), "w") as template:
+            template.write('{% extends "default.lds" %}\n')
+        with open(os.path.join(layouts, "partial.py"), "w") as hook:
+            hook.write("import functools\n"
+                       "def values(size, dts, values):\n"
+                       "    return {'default_stack_size': size}\n"
+                       "layout_values = functools.partial(values, '0x800')\n")
+
+        script, manifest = self.generate("tests/u54mc_ccache.dts",
+                                         ["-T", layouts, "--layout", "partial"])
+
+        self.assertIn(b"__stack_size : 0x800;", script)
+        self.assertEqual(manifest["inputs"]["templates"]["partial.py"],
+                         hash_file(os.path.join(layouts, "partial.py")))
+
+    def test_reproducible(self):
+        first = self.generate("tests/u54mc_ccache.dts", ["--cache-aware"])
+        second = self.generate("tests/u54mc_ccache.dts", ["--cache-aware"])
+
+        self.assertEqual(first, second)
+
+    def test_stdout_matches_file(self):
+        script, _ = self.generate("tests/spike/design.dts")
+        # A text stream which would translate newlines, as on Windows
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding="latin-1", newline="\r\n")
+        with contextlib.redirect_stdout(stdout):
+            main(["-d", "tests/spike/design.dts"])
+
+        self.assertEqual(stdout.buffer.getvalue(), script)
+
+
+class TestToolVersion(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.saved_path = manifest.TOOL_PATH
+        self.git("init", "-q")
+        self.git("-c", "user.name=test", "-c", "user.email=test@example.com",
+                 "commit", "-q", "--allow-empty", "-m", "initial")
+
+    def tearDown(self):
+        manifest.TOOL_PATH = self.saved_path
+        self.tmpdir.cleanup()
+
+    def git(self, *args):
+        subprocess.run(["git"] + list(args), cwd=self.tmpdir.name, check=True)
+
+    def test_tagged_clone(self):
+        self.git("tag", "v1.2.3")
+        manifest.TOOL_PATH = self.tmpdir.name
+        self.assertEqual(get_tool_version(), "v1.2.3")
+
+    def test_untagged_clone(self):
+        manifest.TOOL_PATH = self.tmpdir.name
+        self.assertEqual(get_tool_version(), "unknown")
+
+    def test_vendored(self):
+        self.git("tag", "v1.2.3")
+        manifest.TOOL_PATH = os.path.join(self.tmpdir.name, "ldscript-generator")
+        os.mkdir(manifest.TOOL_PATH)
+        self.assertEqual(get_tool_version(), "unknown")
+
+
+if __name__ == '__main__':
+    unittest.main()
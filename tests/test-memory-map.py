@@ -240,6 +240,51 @@ class TestMemoryMap(unittest.TestCase):
         self.assertEqual(regions["itim"]["base_hex"], "0x1800000")
         self.assertEqual(regions["itim"]["length_hex"], "0x2000")
 
+    def test_get_cache_geometry_no_cache(self):
+        self.assertIsNone(get_cache_geometry(self.tree))
+
+
+class TestCacheGeometry(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tree = pydevicetree.Devicetree.parseFile("tests/u54mc_ccache.dts")
+
+    def test_get_cache_geometry_ccache(self):
+        cache = get_cache_geometry(self.tree)
+
+        self.assertEqual(cache["block_size"], 64)
+        self.assertEqual(cache["sets"], 1024)
+        self.assertEqual(cache["way_size"], 0x10000)
+        self.assertEqual(cache["block_size_hex"], "0x40")
+        self.assertEqual(cache["way_size_hex"], "0x10000")
+        self.assertTrue(cache["shared"])
+
+    def test_get_cache_geometry_dcache(self):
+        ccache = self.tree.match("sifive,ccache0")[0]
+        compatible = [p for p in ccache.properties if p.name == "compatible"][0]
+        ccache.properties.remove(compatible)
+        try:
+            cache = get_cache_geometry(self.tree)
+        finally:
+            ccache.properties.append(compatible)
+
+        self.assertEqual(cache["block_size"], 64)
+        self.assertEqual(cache["sets"], 64)
+        self.assertEqual(cache["way_size"], 0x1000)
+        self.assertFalse(cache["shared"])
+
+    def test_get_cache_geometry_small_block(self):
+        ccache = self.tree.match("sifive,ccache0")[0]
+        saved = ccache.properties
+        ccache.properties = [pydevicetree.Property.from_dts("cache-block-size = <8>;")] + saved
+        try:
+            cache = get_cache_geometry(self.tree)
+        finally:
+            ccache.properties = saved
+
+        # Aligning the stack to 8 bytes would break the 16-byte stack alignment
+        self.assertIsNone(cache)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 SiFive Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import tempfile
+import unittest
+
+import pydevicetree
+
+from dts_prescan import *
+from memory_map import get_memories, get_ram_memories, get_cache_geometry
+
+DESIGNS = [
+    "tests/spike/design.dts",
+    "tests/golden/e31/design.dts",
+    "tests/golden/e31-large-itim/design.dts",
+    "tests/u54mc_ccache.dts",
+]
+
+
+def describe(memories):
+    return {name: (m["name"], m["base"], m["length"], m["path"], m.get("attributes"))
+            for name, m in memories.items()}
+
+
+class TestPrescan(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_dts(self, name, source):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "w") as dts:
+            dts.write(source)
+        return path
+
+    def assert_matches_full_parse(self, design):
+        full = pydevicetree.Devicetree.parseFile(design, followIncludes=True)
+        subset = pydevicetree.Devicetree.from_dts(get_subset_source(design))
+
+        self.assertEqual(describe(get_memories(subset)), describe(get_memories(full)))
+        self.assertEqual(describe(get_ram_memories(subset)),
+                         describe(get_ram_memories(full)))
+        self.assertEqual(get_cache_geometry(subset), get_cache_geometry(full))
+        self.assertEqual(len(subset.get_by_path("/cpus").children),
+                         len(full.get_by_path("/cpus").children))
+
+    def test_matches_full_parse(self):
+        for design in DESIGNS:
+            with self.subTest(design=design):
+                self.assert_matches_full_parse(design)
+
+        base = os.path.abspath("tests/e31_no_chosen.dts")
+        chosen = """/ {
+	chosen {
+		metal,entry = <&testram0 0 0>;
+		metal,ram = <&L6 0 0>;
+	};
+};
+"""
+        designs = {
+            # pydevicetree appends included files after the including file,
+            # so the redefinition in the top-level file comes first
+            "redefined.dts": """/include/ "%s"
+%s/ { soc { dtim@80000000 { reg = <0x80000000 0x4000>; }; }; };
+""" % (base, chosen),
+            # References are resolved before merging, so the overlay follows
+            # the properties of the included node
+            "overlay.dts": """/include/ "%s"
+%s&L6 { reg = <0x80000000 0x4000>; };
+""" % (base, chosen),
+            # Nested /include/s are relative to the top-level file, and are
+            # appended after the top-level file and the including file
+            "nested.dts": '/include/ "sub/base.dtsi"\n/dts-v1/;\n',
+        }
+        os.mkdir(os.path.join(self.tmpdir.name, "sub"))
+        self.write_dts("sub/base.dtsi",
+                       '/include/ "sub/chosen.dtsi"\n/dts-v1/;\n/include/ "%s"\n' % base)
+        self.write_dts("sub/chosen.dtsi",
+                       chosen + "/ { soc { dtim@80000000 { reg = <0x80000000 0x2000>; }; }; };\n")
+        for name, source in designs.items():
+            with self.subTest(design=name):
+                self.assert_matches_full_parse(self.write_dts(name, source))
+
+    def test_include_after_node(self):
+        path = self.write_dts("late.dts", """/ { };
+/include/ "a.dtsi"
+""")
+        self.write_dts("a.dtsi", "/ { };\n")
+        with self.assertRaises(PrescanError):
+            get_subset_source(path)
+
+    def test_skipped_include(self):
+        # pydevicetree never follows an /include/ right after another one
+        path = self.write_dts("skipped.dts", """/include/ "a.dtsi"
+/include/ "b.dtsi"
+/ { };
+""")
+        self.write_dts("a.dtsi", "/ { };\n")
+        with self.assertRaises(PrescanError):
+            get_subset_source(path)
+
+    def test_subset_drops_peripherals(self):
+        source = get_subset_source("tests/u54mc_ccache.dts")
+
+        self.assertNotIn("clint@2000000", source)
+        self.assertIn("L20: rom@20000000", source)
+        # Referenced by the cache controller
+        self.assertIn("L1: interrupt-controller@c000000", source)
+
+    def test_subset_keeps_structure_of_ancestors(self):
+        source = get_subset_source("tests/golden/e31/design.dts")
+
+        self.assertIn("ranges = <0x20000000 0x20000000 0x20000000>;", source)
+        self.assertNotIn("sifive,port-width-bytes", source)
+
+    def test_unresolved_reference(self):
+        path = self.write_dts("missing.dts", """/dts-v1/;
+/ {
+	chosen {
+		metal,entry = <&missing 0 0>;
+	};
+};
+""")
+        with self.assertRaises(PrescanError):
+            get_subset_source(path)
+
+    def test_unsupported_directive(self):
+        path = self.write_dts("delete.dts", """/dts-v1/;
+/ {
+	soc {
+		/delete-node/ dtim@80000000;
+	};
+};
+""")
+        with self.assertRaises(PrescanError):
+            get_subset_source(path)
+
+    def test_parse_devicetree_falls_back(self):
+        path = self.write_dts("fallback.dts", """/dts-v1/;
+/ {
+	#address-cells = <1>;
+	#size-cells = <1>;
+	chosen {
+		metal,entry = <&L1 0 0>;
+		metal,ram = <&L1 0 0>;
+		// Unused, so the full parser never resolves it
+		stdout-path = <&missing>;
+	};
+	cpus {
+	};
+	L1: memory@80000000 {
+		reg = <0x80000000 0x1000>;
+	};
+};
+""")
+        with self.assertLogs("ldscript_generator.dts_prescan", "DEBUG") as logs:
+            tree = parse_devicetree(path)
+
+        self.assertIn("can't resolve reference &missing", logs.output[0])
+        self.assertIn("testram", get_memories(tree))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 SiFive Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+import io
+import os
+import tempfile
+import unittest
+
+from sweep import *
+from memory_map import get_memories
+
+E31 = "tests/golden/e31/design.dts"
+U54MC = "tests/u54mc_ccache.dts"
+
+
+class TestParseOverride(unittest.TestCase):
+    def test_label(self):
+        override = parse_override("&L5:length=0x2000|0x8000")
+        self.assertEqual(override, Override("&L5", "length", ["0x2000", "0x8000"]))
+
+    def test_path_and_property(self):
+        override = parse_override("/chosen:metal,itim=<&L5 0 0>|<&L6 0 0>")
+        self.assertEqual(override, Override("/chosen", "metal,itim", ["<&L5 0 0>", "<&L6 0 0>"]))
+
+    def test_invalid(self):
+        for spec in ["L5:length=1", "&L5:length", "&L5=1", "&L5:length=1|"]:
+            with self.subTest(spec=spec):
+                with self.assertRaises(SweepError):
+                    parse_override(spec)
+
+
+class TestSweep(unittest.TestCase):
+    def sweep(self, path, specs):
+        overrides = [parse_override(spec) for spec in specs]
+        tree = load_devicetree(path, overrides)
+        return tree, sweep(tree, overrides)
+
+    def test_variants(self):
+        _, results = self.sweep(E31, ["&L5:length=0x2000|0x8000",
+                                      "&L6:length=0x4000|0x10000|0x20000"])
+        self.assertEqual([values for values, _ in results], [
+            ["0x2000", "0x4000"], ["0x2000", "0x10000"], ["0x2000", "0x20000"],
+            ["0x8000", "0x4000"], ["0x8000", "0x10000"], ["0x8000", "0x20000"],
+        ])
+        self.assertEqual([result["lengths"]["ram"] for _, result in results],
+                         [0x4000, 0x10000, 0x20000] * 2)
+
+    def test_text_threshold(self):
+        _, results = self.sweep(E31, ["&L5:length=0x4000|0x7fff|0x8000|0x10000"])
+        self.assertEqual([result["text"] for _, result in results],
+                         ["rom", "rom", "itim", "itim"])
+
+    def test_ram_free(self):
+        _, results = self.sweep(U54MC, ["&L21:length=0x10000"])
+        # Two harts with a 0x400 stack each and a 0x800 heap
+        self.assertEqual(results[0][1]["ram_free"], 0x10000 - 2 * 0x400 - 0x800)
+
+    def test_chosen(self):
+        _, results = self.sweep(E31, ["/chosen:metal,itim=<&L5 0 0>|<&L6 0 0>"])
+        self.assertEqual(results[0][1]["itim"], "itim")
+        self.assertIn("itim", results[0][1]["lengths"])
+        self.assertEqual(results[1][1]["itim"], "ram")
+        self.assertNotIn("itim", results[1][1]["lengths"])
+
+    def test_ways(self):
+        _, results = self.sweep(U54MC, ["&L3:ways=2|16"])
+        # One way of 1024 sets of 64 bytes stays enabled as cache
+        self.assertEqual([result["lengths"]["lim"] for _, result in results],
+                         [0x10000, 0xf0000])
+
+    def test_restores_tree(self):
+        tree, _ = self.sweep(E31, ["&L5:length=0x10000",
+                                   "/chosen:metal,itim=<&L6 0 0>"])
+        memories = get_memories(tree)
+        self.assertEqual(memories["itim"]["length"], 0x2000)
+        self.assertEqual(memories["ram"]["length"], 0x10000)
+
+    def test_unknown_target(self):
+        with self.assertRaises(SweepError):
+            self.sweep(E31, ["&nope:length=1"])
+        with self.assertRaises(SweepError):
+            self.sweep(E31, ["/soc/nope:length=1"])
+
+    def test_ways_without_cache(self):
+        with self.assertRaises(SweepError):
+            self.sweep(E31, ["&L5:ways=2"])
+
+    def test_reference_outside_prescan(self):
+        _, results = self.sweep(E31, ["&L2:length=0x10"])
+        self.assertEqual(len(results), 1)
+
+    def test_path_target_outside_prescan(self):
+        _, results = self.sweep(E31, ["/soc/clint@2000000:length=0x10"])
+        self.assertEqual(len(results), 1)
+
+    def test_path_reference_outside_prescan(self):
+        _, results = self.sweep(E31, [
+            "/chosen:metal,ram=<&{/soc/teststatus@4000} 0 0>|<&L6 0 0>"])
+        self.assertEqual(results[0][1]["lengths"]["ram"], 0x1000)
+        self.assertEqual(results[1][1]["lengths"]["ram"], 0x10000)
+
+    def test_string_reference(self):
+        # A & inside a string is not a reference
+        overrides = [parse_override('/chosen:stdout-path="&nope"')]
+        self.assertEqual(get_override_references(overrides), {"/chosen"})
+        self.assertEqual(len(sweep(load_devicetree(E31, overrides), overrides)), 1)
+
+    def test_unknown_path_reference(self):
+        with self.assertRaises(SweepError):
+            self.sweep(E31, ["/chosen:metal,ram=<&{/soc/nope} 0 0>"])
+
+
+class TestOutput(unittest.TestCase):
+    def setUp(self):
+        self.overrides = [parse_override("&L5:length=0x2000|0x8000")]
+        self.results = sweep(load_devicetree(E31, self.overrides), self.overrides)
+
+    def test_table(self):
+        header, rows = get_table(self.overrides, self.results)
+        self.assertEqual(header[0], "&L5:length")
+        self.assertEqual(header[-2:], ["ramrodata .text", "ram free"])
+        self.assertEqual(len(rows), 2)
+
+        output = io.StringIO()
+        write_table(output, header, rows)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1].index("itim "), lines[0].index("itim vma"))
+
+    def test_csv(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "sweep.csv")
+            main(["-q", "-d", E31, "--vary", "&L5:length=0x2000|0x8000",
+                  "--format", "csv", "-o", path])
+            with open(path) as output:
+                lines = output.read().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith("&L5:length,"))
+        self.assertTrue(lines[2].startswith("0x8000,0x8000,"))
+        self.assertIn(",itim,", lines[2])
+
+    def test_format_size(self):
+        self.assertEqual(format_size(0x400), "0x400")
+        self.assertEqual(format_size(-0x400), "-0x400")
+
+
+if __name__ == '__main__':
+    unittest.main()